@@ -5,71 +5,399 @@ Flask-based web interface for the converter
 """
 
 from flask import Flask, render_template, request, send_file, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget, FileTarget
+from PIL import Image, UnidentifiedImageError
 import os
 import io
+import re
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from png_to_bin import convert_png_to_bin, read_bin_to_png
+from png_to_bin import convert_image_to_bin, copy_output, read_bin_to_png
+
+try:
+    import redis
+except ImportError:  # Optional: only needed when BINCONVERT_REDIS_URL is set
+    redis = None
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['ALLOWED_EXTENSIONS_PNG'] = {'png'}
-app.config['ALLOWED_EXTENSIONS_BIN'] = {'bin'}
+app.config['UPLOAD_CHUNK_SIZE'] = 64 * 1024  # Bytes read from the request per parser call
+# Internal nginx location mapped to UPLOAD_FOLDER, e.g. '/protected/'. When set,
+# downloads are handed to nginx via X-Accel-Redirect and served with sendfile(2).
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('BINCONVERT_ACCEL_REDIRECT')
+app.config['CONVERSION_CACHE_SIZE'] = 32  # Recent uploads whose output can be reused
+# Optional Redis shared by all workers as a second-level conversion cache
+app.config['REDIS_URL'] = os.environ.get('BINCONVERT_REDIS_URL')
+app.config['REDIS_CACHE_TTL'] = 3600  # Seconds a shared cache entry is kept
 
 # Create uploads folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# (endpoint, upload digest) -> (output path, original size, converted size, output mtime_ns)
+_conversion_cache = OrderedDict()
+_conversion_cache_lock = threading.Lock()
+
+if app.config['REDIS_URL']:
+    if redis is None:
+        raise RuntimeError('BINCONVERT_REDIS_URL is set but the redis package is not installed')
+    _redis = redis.Redis.from_url(app.config['REDIS_URL'], decode_responses=True)
+else:
+    _redis = None
+
+
+# Extension checks, compiled once instead of splitting the name on every upload
+_is_png_name = re.compile(r'\.png\Z', re.IGNORECASE).search
+_is_bin_name = re.compile(r'\.bin\Z', re.IGNORECASE).search
+
 
 def allowed_png(filename):
     """Check if file is a PNG"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS_PNG']
+    return _is_png_name(filename) is not None
 
 
 def allowed_bin(filename):
     """Check if file is a BIN"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS_BIN']
+    return _is_bin_name(filename) is not None
+
+
+class HashingFileTarget(FileTarget):
+    """FileTarget that also records the BLAKE2b-64 digest and size of the data it writes"""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.hash = hashlib.blake2b(digest_size=8)
+        self.size = 0
+        self.finished = False
+
+    def on_data_received(self, chunk):
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        super().on_data_received(chunk)
+
+    def on_finish(self):
+        super().on_finish()
+        self.finished = True  # The part's closing boundary was seen
+
+    def discard(self):
+        """Remove the temp file of a rejected or failed upload"""
+        super().on_finish()  # Closes the file if parsing stopped midway
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+class HashingMemoryTarget(BaseTarget):
+    """Target that keeps the upload in a BytesIO and records its BLAKE2b-64 digest and size"""
+
+    def __init__(self):
+        super().__init__()
+        self.hash = hashlib.blake2b(digest_size=8)
+        self.size = 0
+        self.buffer = io.BytesIO()
+        self.finished = False
+
+    def on_data_received(self, chunk):
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        self.buffer.write(chunk)
+
+    def on_finish(self):
+        self.finished = True  # The part's closing boundary was seen
+
+    def discard(self):
+        """Free the buffered data of a rejected or failed upload"""
+        self.buffer.close()
+
+
+def upload_path():
+    """Return a fresh temp path in the uploads folder for an incoming file"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], f'.upload-{uuid.uuid4().hex}')
+
+
+def receive_upload(target):
+    """
+    Stream the multipart 'file' field into the given target.
+
+    The body is read from request.stream in fixed-size blocks and fed to
+    streaming_form_data, so Werkzeug's form parser (and its spooled temp
+    file) never sees the upload. File targets write to a temporary path
+    that the caller renames once the filename has been validated.
+
+    Args:
+        target (HashingFileTarget or HashingMemoryTarget): where the data goes
+
+    Returns:
+        The target, now holding the client filename and the digest/size
+        of the uploaded data
+
+    Raises:
+        ParseFailedException: if the body is malformed or the 'file' part
+                              never reached its closing boundary
+    """
+    parser = StreamingFormDataParser(headers={'Content-Type': request.content_type or ''})
+    parser.register('file', target)
+
+    limit = app.config['MAX_CONTENT_LENGTH']
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    seen = 0
+    try:
+        while True:
+            chunk = request.stream.read(chunk_size)
+            if not chunk:
+                break
+            seen += len(chunk)
+            if limit is not None and seen > limit:
+                raise RequestEntityTooLarge()
+            parser.data_received(chunk)
+    except BaseException:
+        target.discard()
+        raise
+
+    # A body cut off before the part's closing boundary is not a complete file
+    if not target.finished:
+        target.discard()
+        raise ParseFailedException('Upload ended before the closing boundary')
+
+    return target
+
+
+# Upload endpoints and the target each one streams its 'file' field into
+UPLOAD_TARGETS = {
+    'png_to_bin_api': HashingMemoryTarget,
+    'bin_to_png_api': lambda: HashingFileTarget(upload_path()),
+}
+
+
+@app.before_request
+def parse_upload():
+    """
+    Parse multipart bodies of the upload endpoints before the view runs.
+
+    The parsed target is stored in request.environ['binconvert.upload'];
+    views never touch request.files, so Werkzeug's multipart parser is
+    bypassed end to end.
+    """
+    make_target = UPLOAD_TARGETS.get(request.endpoint)
+    if make_target is None or request.mimetype != 'multipart/form-data':
+        return None
+    
+    try:
+        request.environ['binconvert.upload'] = receive_upload(make_target())
+    except ParseFailedException:
+        return jsonify({'success': False, 'error': 'No file provided'}), 400
+    except OSError as e:
+        # e.g. disk full or uploads folder missing; keep the views' JSON error shape
+        return jsonify({'success': False, 'error': f'Error: {str(e)}'}), 500
+    
+    return None
+
+
+def cached_conversion(key):
+    """
+    Look up the output of an earlier conversion of identical input.
+
+    The per-process LRU is checked first, then Redis when it is configured.
+    Entries whose output file has since been deleted or rewritten are dropped.
+
+    Returns:
+        tuple or None: (output path, original size, converted size, mtime_ns)
+    """
+    with _conversion_cache_lock:
+        entry = _conversion_cache.get(key)
+        if entry is not None:
+            _conversion_cache.move_to_end(key)
+    
+    if entry is None:
+        entry = shared_conversion(key)
+        if entry is None:
+            return None
+        remember_local(key, entry)
+    
+    path, _, converted_size, mtime_ns = entry
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    
+    if st is None or st.st_size != converted_size or st.st_mtime_ns != mtime_ns:
+        with _conversion_cache_lock:
+            _conversion_cache.pop(key, None)
+        forget_shared(key)
+        return None
+    
+    return entry
+
+
+def remember_conversion(key, path, original_size):
+    """Record a finished conversion and return the size of its output"""
+    st = os.stat(path)
+    entry = (path, original_size, st.st_size, st.st_mtime_ns)
+    remember_local(key, entry)
+    remember_shared(key, entry)
+    return st.st_size
+
+
+def remember_local(key, entry):
+    """Add an entry to the per-process LRU, evicting the oldest if full"""
+    with _conversion_cache_lock:
+        _conversion_cache[key] = entry
+        _conversion_cache.move_to_end(key)
+        while len(_conversion_cache) > app.config['CONVERSION_CACHE_SIZE']:
+            _conversion_cache.popitem(last=False)
+
+
+def shared_conversion(key):
+    """
+    Look up a conversion in Redis.
+
+    A bitmap indexed by the low 24 bits of the digest answers "never seen"
+    with a single GETBIT, so only likely hits pay for fetching the entry.
+    Redis errors are treated as a miss.
+    """
+    if _redis is None:
+        return None
+    
+    endpoint, digest = key
+    try:
+        if not _redis.getbit(f'seen:{endpoint}', int(digest, 16) & 0xFFFFFF):
+            return None
+        fields = _redis.hgetall(f'{endpoint}:{digest}')
+    except redis.RedisError:
+        return None
+    
+    if not fields:
+        return None
+    return (fields['path'], int(fields['original_size']),
+            int(fields['converted_size']), int(fields['mtime_ns']))
+
+
+def remember_shared(key, entry):
+    """Publish a conversion to Redis (best effort)"""
+    if _redis is None:
+        return
+    
+    endpoint, digest = key
+    path, original_size, converted_size, mtime_ns = entry
+    try:
+        pipe = _redis.pipeline()
+        pipe.setbit(f'seen:{endpoint}', int(digest, 16) & 0xFFFFFF, 1)
+        pipe.hset(f'{endpoint}:{digest}', mapping={
+            'path': path,
+            'original_size': original_size,
+            'converted_size': converted_size,
+            'mtime_ns': mtime_ns
+        })
+        pipe.expire(f'{endpoint}:{digest}', app.config['REDIS_CACHE_TTL'])
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def forget_shared(key):
+    """Drop a stale conversion from Redis (best effort)"""
+    if _redis is None:
+        return
+    
+    endpoint, digest = key
+    try:
+        _redis.delete(f'{endpoint}:{digest}')
+    except redis.RedisError:
+        pass
+
+
+def reuse_output(src, dest):
+    """
+    Copy a cached output to a new name.
+
+    copy_output only swaps dest in once the copy is complete. It is a copy
+    rather than a hard link because platforms without O_TMPFILE still
+    rewrite outputs in place.
+    """
+    if os.path.abspath(src) != os.path.abspath(dest):
+        copy_output(src, dest)
+
+
+# index.html has no per-request content, so render it once at startup
+with app.app_context():
+    _INDEX_HTML = render_template('index.html').encode('utf-8')
+_INDEX_ETAG = hashlib.blake2b(_INDEX_HTML, digest_size=8).hexdigest()
 
 
 @app.route('/')
 def index():
-    """Render the main page"""
-    return render_template('index.html')
+    """Serve the pre-rendered main page"""
+    response = app.response_class(_INDEX_HTML, mimetype='text/html')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.set_etag(_INDEX_ETAG)
+    return response.make_conditional(request)
 
 
 @app.route('/api/png-to-bin', methods=['POST'])
 def png_to_bin_api():
     """API endpoint to convert PNG to BIN"""
     try:
-        # Check if file is in request
-        if 'file' not in request.files:
+        # The upload was received into memory; only the BIN output touches disk
+        upload = request.environ.get('binconvert.upload')
+        
+        if upload is None:
             return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        file = request.files['file']
+        if upload.multipart_filename is None:
+            upload.discard()
+            return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        if file.filename == '':
+        if upload.multipart_filename == '':
+            upload.discard()
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        if not allowed_png(file.filename):
+        if not allowed_png(upload.multipart_filename):
+            upload.discard()
             return jsonify({'success': False, 'error': 'File must be a PNG image'}), 400
         
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        png_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(png_path)
+        filename = secure_filename(upload.multipart_filename)
         
         # Convert to BIN
         bin_filename = filename.rsplit('.', 1)[0] + '.bin'
         bin_path = os.path.join(app.config['UPLOAD_FOLDER'], bin_filename)
         
-        success, message = convert_png_to_bin(png_path, bin_path)
+        # Reuse the output of an identical earlier upload if we still have it
+        key = ('png-to-bin', upload.hash.hexdigest())
+        cached = cached_conversion(key)
         
-        if not success:
-            return jsonify({'success': False, 'error': message}), 400
-        
-        # Get file size info
-        png_size = os.path.getsize(png_path)
-        bin_size = os.path.getsize(bin_path)
+        if cached is not None:
+            reuse_output(cached[0], bin_path)
+            message = f"Reused previous conversion: {filename} -> {bin_path}"
+            _, png_size, bin_size, _ = cached
+        else:
+            upload.buffer.seek(0)
+            try:
+                img = Image.open(upload.buffer)
+            except UnidentifiedImageError:
+                upload.discard()
+                return jsonify({'success': False, 'error': 'File is not a valid PNG image'}), 400
+            except Image.DecompressionBombError as e:
+                upload.discard()
+                return jsonify({'success': False, 'error': f'Error converting PNG: {str(e)}'}), 400
+            
+            with img:
+                success, message = convert_image_to_bin(img, bin_path)
+            
+            if not success:
+                return jsonify({'success': False, 'error': message}), 400
+            
+            message = f"Successfully converted: {filename} -> {bin_path}"
+            
+            png_size = upload.size
+            bin_size = remember_conversion(key, bin_path, png_size)
         
         return jsonify({
             'success': True,
@@ -88,35 +416,49 @@ def png_to_bin_api():
 def bin_to_png_api():
     """API endpoint to convert BIN back to PNG"""
     try:
-        # Check if file is in request
-        if 'file' not in request.files:
+        # The upload was streamed to a temp file in the uploads folder
+        upload = request.environ.get('binconvert.upload')
+        
+        if upload is None:
             return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        file = request.files['file']
+        if upload.multipart_filename is None:
+            upload.discard()
+            return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        if file.filename == '':
+        if upload.multipart_filename == '':
+            upload.discard()
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        if not allowed_bin(file.filename):
+        if not allowed_bin(upload.multipart_filename):
+            upload.discard()
             return jsonify({'success': False, 'error': 'File must be a BIN file'}), 400
         
-        # Save uploaded file
-        filename = secure_filename(file.filename)
+        # Move uploaded file into place
+        filename = secure_filename(upload.multipart_filename)
         bin_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(bin_path)
+        os.replace(upload.filename, bin_path)
         
         # Convert to PNG
         png_filename = filename.rsplit('.', 1)[0] + '.png'
         png_path = os.path.join(app.config['UPLOAD_FOLDER'], png_filename)
         
-        success, message = read_bin_to_png(bin_path, png_path)
-        
-        if not success:
-            return jsonify({'success': False, 'error': message}), 400
+        # Reuse the output of an identical earlier upload if we still have it
+        key = ('bin-to-png', upload.hash.hexdigest())
+        cached = cached_conversion(key)
         
-        # Get file size info
-        bin_size = os.path.getsize(bin_path)
-        png_size = os.path.getsize(png_path)
+        if cached is not None:
+            reuse_output(cached[0], png_path)
+            message = f"Reused previous conversion: {bin_path} -> {png_path}"
+            _, bin_size, png_size, _ = cached
+        else:
+            success, message = read_bin_to_png(bin_path, png_path)
+            
+            if not success:
+                return jsonify({'success': False, 'error': message}), 400
+            
+            bin_size = upload.size
+            png_size = remember_conversion(key, png_path, bin_size)
         
         return jsonify({
             'success': True,
@@ -138,14 +480,30 @@ def download_file(filename):
         filename = secure_filename(filename)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
+        accel_prefix = app.config['ACCEL_REDIRECT_PREFIX']
+        if accel_prefix:
+            if not os.path.isfile(file_path):
+                return jsonify({'error': 'File not found'}), 404
+            
+            # Let the front-end server stream the file itself
+            response = app.response_class(mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+            return response
         
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename
-        )
+        # Passing the path lets the server use wsgi.file_wrapper (sendfile under gunicorn).
+        # send_file stats the file once for its size and mtime, which doubles as
+        # the existence check.
+        try:
+            return send_file(
+                file_path,
+                as_attachment=True,
+                download_name=filename,
+                conditional=True,
+                etag=False
+            )
+        except FileNotFoundError:
+            return jsonify({'error': 'File not found'}), 404
     
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
@@ -158,8 +516,10 @@ def cleanup_file(filename):
         filename = secure_filename(filename)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        if os.path.exists(file_path):
+        try:
             os.remove(file_path)
+        except FileNotFoundError:
+            pass
         
         return jsonify({'success': True}), 200
     
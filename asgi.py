@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for the PNG to BIN Converter
+Runs the Flask app on an async server so slow uploads don't tie up workers
+
+Usage:
+    uvicorn asgi:application --workers 4
+"""
+
+from a2wsgi import WSGIMiddleware
+from app import app
+
+# Each request runs the Flask view (and its Pillow work) on this thread pool,
+# while the event loop paces request/response bodies for slow clients.
+application = WSGIMiddleware(app, workers=10)
@@ -5,6 +5,14 @@ Example usage of the PNG to BIN converter
 
 from png_to_bin import convert_png_to_bin, read_bin_to_png
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def _convert_one(paths):
+    """Convert a (png_file, bin_file) pair; module level so worker processes can pickle it"""
+    png_file, bin_file = paths
+    return convert_png_to_bin(png_file, bin_file)
 
 
 def example_1_basic_conversion():
@@ -71,15 +79,19 @@ def example_4_batch_conversion():
     print("=" * 50)
     
     colors = ['red', 'green', 'blue', 'yellow', 'magenta']
+    png_files = [f'example4_color_{i}.png' for i in range(1, len(colors) + 1)]
+    bin_files = [f'example4_color_{i}.bin' for i in range(1, len(colors) + 1)]
     
-    for i, color in enumerate(colors, 1):
+    for color, png_file in zip(colors, png_files):
         # Create image
         img = Image.new('RGB', (50, 50), color=color)
-        png_file = f'example4_color_{i}.png'
-        bin_file = f'example4_color_{i}.bin'
-        
         img.save(png_file)
-        success, message = convert_png_to_bin(png_file, bin_file)
+    
+    # Convert all files in parallel, one worker process per core
+    with ProcessPoolExecutor() as executor:
+        results = list(executor.map(_convert_one, zip(png_files, bin_files)))
+    
+    for color, (success, message) in zip(colors, results):
         print(f"✓ {color.capitalize()}: {message}")
     print()
 
@@ -90,17 +102,13 @@ def example_5_complex_image():
     print("Example 5: Complex Image with Gradient")
     print("=" * 50)
     
-    # Create a gradient image
-    img = Image.new('RGBA', (200, 200))
-    pixels = img.load()
-    
-    for y in range(200):
-        for x in range(200):
-            r = int((x / 200) * 255)
-            g = int((y / 200) * 255)
-            b = 128
-            a = int(((x + y) / 400) * 255)
-            pixels[x, y] = (r, g, b, a)
+    # Create a gradient image (whole channels at once, no per-pixel loop)
+    ys, xs = np.indices((200, 200), dtype=np.uint32)
+    r = (xs * 255 // 200).astype(np.uint8)
+    g = (ys * 255 // 200).astype(np.uint8)
+    b = np.full_like(r, 128)
+    a = ((xs + ys) * 255 // 400).astype(np.uint8)
+    img = Image.fromarray(np.stack([r, g, b, a], axis=-1))
     
     img.save('example5_gradient.png')
     print("✓ Created gradient image")
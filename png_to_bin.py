@@ -4,13 +4,122 @@ PNG to BIN File Converter
 Converts PNG images to binary format with metadata
 """
 
+import glob
+import mmap
+import os
+import shutil
 import struct
 import sys
+import threading
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, BinaryIO, Iterator, List, Optional, Sequence, Tuple, Union
 from PIL import Image
 
+PathLike = Union[str, Path]
 
-def convert_png_to_bin(png_path, bin_path=None, include_metadata=True):
+# BIN metadata header: [MAGIC:4][WIDTH:4][HEIGHT:4][MODE:1][DATA_SIZE:4]
+# MAGIC is handled as a little-endian uint32 so it is checked with an int compare
+_HDR = struct.Struct('<IIIBI')
+_MAGIC = 0x00474E50  # b'PNG\x00'
+
+# MODE byte: low 7 bits are bytes per pixel, the high bit marks zlib-compressed data
+_MODE_RGBA = 4
+_MODE_PALETTE = 1  # Followed by [PALETTE_COUNT-1:1][RGBA palette:4*count] before DATA
+_MODE_ZLIB = 0x80
+_ZLIB_LEVEL = 3
+# Largest inflated/compressed size ratio accepted when reading. Level 3 tops out
+# around 230:1 even on constant data, so files written here stay well below it.
+_ZLIB_MAX_RATIO = 256
+
+# Per-thread scratch buffer the header is packed into, so batch conversions
+# don't allocate a new bytes object per file
+_hdr_local = threading.local()
+
+
+def _header_buffer() -> bytearray:
+    """Return this thread's reusable header buffer."""
+    buf = getattr(_hdr_local, 'buf', None)
+    if buf is None:
+        buf = _hdr_local.buf = bytearray(_HDR.size)
+    return buf
+
+
+@contextmanager
+def _output_file(path: PathLike) -> Iterator[BinaryIO]:
+    """
+    Open an output file that only appears at its path once fully written.
+    
+    On Linux the data goes to an unnamed O_TMPFILE inode in the target
+    directory, which is linked into place after the last write. No directory
+    entry is created up front, and a crash never leaves a partial file
+    behind. Platforms or filesystems without O_TMPFILE get a plain open().
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    o_tmpfile = getattr(os, 'O_TMPFILE', None)
+    fd = -1
+    if o_tmpfile is not None:
+        try:
+            fd = os.open(directory, o_tmpfile | os.O_WRONLY, 0o644)
+        except OSError:
+            fd = -1
+    
+    if fd < 0:
+        with open(path, 'wb') as f:
+            yield f
+        return
+    
+    with os.fdopen(fd, 'wb') as f:
+        yield f
+        f.flush()
+        
+        # Passing dir_fd makes os.link use linkat(AT_SYMLINK_FOLLOW), which is
+        # needed to link the /proc/self/fd entry rather than the symlink itself
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            fd_path = f'/proc/self/fd/{fd}'
+            try:
+                os.link(fd_path, name, dst_dir_fd=dir_fd, follow_symlinks=True)
+            except FileExistsError:
+                # Replace the existing file atomically via a temporary name that
+                # is unique per call, so concurrent writers of one path don't collide
+                while True:
+                    tmp_name = f'.{name}.{uuid.uuid4().hex}.tmp'
+                    try:
+                        os.link(fd_path, tmp_name, dst_dir_fd=dir_fd, follow_symlinks=True)
+                    except FileExistsError:
+                        continue
+                    break
+                try:
+                    os.replace(tmp_name, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+                except BaseException:
+                    os.unlink(tmp_name, dir_fd=dir_fd)
+                    raise
+        finally:
+            os.close(dir_fd)
+
+
+def copy_output(src: PathLike, dest: PathLike) -> None:
+    """
+    Copy a converted file to a new path.
+    
+    The copy is written the same way conversions write their outputs, so
+    dest only appears once it is complete.
+    
+    Args:
+        src (str or Path): Existing BIN or PNG file
+        dest (str or Path): Path for the copy (replaced if it exists)
+    """
+    with open(src, 'rb') as fsrc, _output_file(dest) as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def convert_png_to_bin(png_path: PathLike, bin_path: Optional[PathLike] = None,
+                       include_metadata: bool = True, compress: bool = False,
+                       palette: bool = False) -> Tuple[bool, str]:
     """
     Convert a PNG image to a binary file.
     
@@ -19,6 +128,9 @@ def convert_png_to_bin(png_path, bin_path=None, include_metadata=True):
         bin_path (str or Path, optional): Path for the output BIN file.
                                          If None, uses PNG filename with .bin extension
         include_metadata (bool): Whether to include image metadata in binary
+        compress (bool): Whether to zlib-compress the pixel data (requires metadata)
+        palette (bool): Store images with at most 256 distinct colors as 1-byte
+                        palette indices instead of RGBA (requires metadata)
         
     Returns:
         tuple: (success: bool, message: str)
@@ -26,22 +138,60 @@ def convert_png_to_bin(png_path, bin_path=None, include_metadata=True):
     try:
         png_path = Path(png_path)
         
-        if not png_path.exists():
-            return False, f"PNG file not found: {png_path}"
-        
         if not png_path.suffix.lower() == '.png':
             return False, f"File is not a PNG: {png_path}"
         
-        # Open PNG image
-        img = Image.open(png_path)
+        # Open PNG image (a missing file surfaces here rather than via a separate stat)
+        try:
+            img = Image.open(png_path)
+        except FileNotFoundError:
+            return False, f"PNG file not found: {png_path}"
         
         # Set default output path if not provided
         if bin_path is None:
             bin_path = png_path.with_suffix('.bin')
-        else:
-            bin_path = Path(bin_path)
         
-        # Convert image to RGBA if needed
+        success, message = convert_image_to_bin(img, bin_path, include_metadata, compress, palette)
+        if not success:
+            return False, message
+        
+        return True, f"Successfully converted: {png_path} -> {bin_path}"
+    
+    except Exception as e:
+        return False, f"Error converting PNG: {str(e)}"
+
+
+def convert_image_to_bin(img: Image.Image, bin_path: PathLike,
+                         include_metadata: bool = True, compress: bool = False,
+                         palette: bool = False) -> Tuple[bool, str]:
+    """
+    Write an already opened image to a binary file.
+    
+    Useful when the PNG is held in memory (e.g. an upload opened from a
+    BytesIO) and never needs to be written to disk itself.
+    
+    Args:
+        img (PIL.Image.Image): Image to convert
+        bin_path (str or Path): Path for the output BIN file
+        include_metadata (bool): Whether to include image metadata in binary
+        compress (bool): Whether to zlib-compress the pixel data (requires metadata)
+        palette (bool): Store images with at most 256 distinct colors as 1-byte
+                        palette indices instead of RGBA (requires metadata)
+        
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    try:
+        bin_path = Path(bin_path)
+        
+        if compress and not include_metadata:
+            return False, "Compression requires the metadata header"
+        
+        if palette and not include_metadata:
+            return False, "Palette mode requires the metadata header"
+        
+        # Convert image to RGBA if needed (already-RGBA images skip the copy;
+        # palette transparency is resolved by this single convert)
         if img.mode != 'RGBA':
             img = img.convert('RGBA')
         
@@ -50,29 +200,59 @@ def convert_png_to_bin(png_path, bin_path=None, include_metadata=True):
         
         # Extract pixel data
         pixel_data = img.tobytes()
+        mode = _MODE_RGBA
+        palette_block = b''
+        
+        if palette:
+            # getcolors gives up (returns None) as soon as it sees a 257th color
+            colors = img.getcolors(256)
+            if colors is not None:
+                pixel_data, palette_data = _index_pixels(pixel_data, colors)
+                palette_block = bytes([len(colors) - 1]) + palette_data
+                mode = _MODE_PALETTE
         
-        with open(bin_path, 'wb') as f:
+        if compress:
+            pixel_data = zlib.compress(pixel_data, _ZLIB_LEVEL)
+            mode |= _MODE_ZLIB
+        
+        with _output_file(bin_path) as f:
             if include_metadata:
                 # Write metadata header
                 # Format: [MAGIC:4][WIDTH:4][HEIGHT:4][MODE:1][DATA_SIZE:4][DATA:variable]
-                magic = b'PNG\x00'
-                f.write(magic)
-                f.write(struct.pack('<I', width))
-                f.write(struct.pack('<I', height))
-                f.write(struct.pack('B', 4))  # RGBA mode (4 bytes per pixel)
-                f.write(struct.pack('<I', len(pixel_data)))
-                f.write(pixel_data)
+                # MODE 4 = RGBA (4 bytes per pixel), 1 = palette indices (palette
+                # block follows the header), +0x80 if DATA is zlib-compressed
+                header = _header_buffer()
+                _HDR.pack_into(header, 0, _MAGIC, width, height, mode, len(pixel_data))
+                f.writelines((header, palette_block, pixel_data))
             else:
                 # Write raw pixel data only
                 f.write(pixel_data)
         
-        return True, f"Successfully converted: {png_path} -> {bin_path}"
+        return True, f"Successfully converted image -> {bin_path}"
     
     except Exception as e:
         return False, f"Error converting PNG: {str(e)}"
 
 
-def read_bin_to_png(bin_path, png_path=None, has_metadata=True):
+def _index_pixels(pixel_data: bytes, colors: Sequence[Tuple[int, Any]]) -> Tuple[bytes, bytes]:
+    """
+    Map RGBA pixel data onto an exact palette of its colors.
+    
+    Each pixel is looked up as one 32-bit word, so the per-pixel work runs
+    inside map() rather than as Python bytecode. Pillow's quantizers are not
+    used because they are not guaranteed to be lossless.
+    
+    Returns:
+        tuple: (indices: one byte per pixel, palette: 4 RGBA bytes per color)
+    """
+    palette = b''.join(bytes(rgba) for _, rgba in colors)
+    lookup = {word: i for i, word in enumerate(memoryview(palette).cast('I'))}
+    indices = bytes(map(lookup.__getitem__, memoryview(pixel_data).cast('I')))
+    return indices, palette
+
+
+def read_bin_to_png(bin_path: PathLike, png_path: Optional[PathLike] = None,
+                    has_metadata: bool = True, compress_level: int = 1) -> Tuple[bool, str]:
     """
     Convert a BIN file back to PNG image.
     
@@ -81,6 +261,9 @@ def read_bin_to_png(bin_path, png_path=None, has_metadata=True):
         png_path (str or Path, optional): Path for the output PNG file.
                                          If None, uses BIN filename with .png extension
         has_metadata (bool): Whether the BIN file includes metadata
+        compress_level (int): zlib level for the PNG, 0-9. The default of 1
+                              encodes much faster than Pillow's 6 for a
+                              slightly larger file
         
     Returns:
         tuple: (success: bool, message: str)
@@ -88,35 +271,70 @@ def read_bin_to_png(bin_path, png_path=None, has_metadata=True):
     try:
         bin_path = Path(bin_path)
         
-        if not bin_path.exists():
-            return False, f"BIN file not found: {bin_path}"
-        
         # Set default output path if not provided
         if png_path is None:
             png_path = bin_path.with_suffix('.png')
         else:
             png_path = Path(png_path)
         
-        with open(bin_path, 'rb') as f:
-            if has_metadata:
+        if not has_metadata:
+            # For raw data, we need width and height from somewhere
+            # This is a limitation without metadata
+            return False, "Cannot read raw BIN without metadata (width/height unknown)"
+        
+        try:
+            f = open(bin_path, 'rb')
+        except FileNotFoundError:
+            return False, f"BIN file not found: {bin_path}"
+        
+        with f:
+            if os.fstat(f.fileno()).st_size < _HDR.size:
+                return False, "Invalid BIN file format (missing PNG magic number)"
+            
+            # Map the file and let Pillow read the pixels straight from the
+            # mapped pages instead of copying them into a bytes object first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
                 # Read metadata header
-                magic = f.read(4)
-                if magic != b'PNG\x00':
+                magic, width, height, mode_bytes, data_size = _HDR.unpack_from(mm, 0)
+                if magic != _MAGIC:
                     return False, "Invalid BIN file format (missing PNG magic number)"
                 
-                width = struct.unpack('<I', f.read(4))[0]
-                height = struct.unpack('<I', f.read(4))[0]
-                mode_bytes = struct.unpack('B', f.read(1))[0]
-                data_size = struct.unpack('<I', f.read(4))[0]
-                pixel_data = f.read(data_size)
-            else:
-                # For raw data, we need width and height from somewhere
-                # This is a limitation without metadata
-                return False, "Cannot read raw BIN without metadata (width/height unknown)"
-        
-        # Create image from pixel data
-        img = Image.frombytes('RGBA', (width, height), pixel_data)
-        img.save(png_path, 'PNG')
+                offset = _HDR.size
+                palette = None
+                if mode_bytes & ~_MODE_ZLIB == _MODE_PALETTE:
+                    count = mm[offset] + 1
+                    palette = mm[offset + 1:offset + 1 + 4 * count]
+                    offset += 1 + 4 * count
+                img_mode = 'RGBA' if palette is None else 'P'
+                
+                with memoryview(mm)[offset:offset + data_size] as pixel_data:
+                    # Create image from pixel data
+                    if mode_bytes & _MODE_ZLIB:
+                        # Compressed data has to be inflated into a new buffer. The
+                        # header's dimensions are untrusted, so bound them by Pillow's
+                        # pixel limit and by the real compressed size before inflating,
+                        # then cap the output at the size they imply.
+                        expected = width * height * (_MODE_RGBA if palette is None else _MODE_PALETTE)
+                        max_pixels = Image.MAX_IMAGE_PIXELS
+                        if ((max_pixels is not None and width * height > max_pixels)
+                                or expected > data_size * _ZLIB_MAX_RATIO):
+                            return False, "Invalid BIN file format (compressed data does not match image size)"
+                        inflater = zlib.decompressobj()
+                        raw = inflater.decompress(pixel_data, expected)
+                        if len(raw) != expected or inflater.unconsumed_tail:
+                            return False, "Invalid BIN file format (compressed data does not match image size)"
+                        img = Image.frombytes(img_mode, (width, height), raw)
+                    else:
+                        img = Image.frombuffer(img_mode, (width, height), pixel_data,  # type: ignore[arg-type]
+                                               'raw', img_mode, 0, 1)
+                    if palette is not None:
+                        img.putpalette(palette, 'RGBA')
+                    try:
+                        with _output_file(png_path) as out:
+                            img.save(out, 'PNG', compress_level=compress_level, optimize=False)
+                    finally:
+                        # Drop Pillow's reference to the mapping before it is closed
+                        img.close()
         
         return True, f"Successfully converted: {bin_path} -> {png_path}"
     
@@ -124,33 +342,78 @@ def read_bin_to_png(bin_path, png_path=None, has_metadata=True):
         return False, f"Error converting BIN to PNG: {str(e)}"
 
 
-def main():
+def _convert_one(png_path: str, compress: bool, palette: bool) -> Tuple[bool, str]:
+    """Convert a single PNG next to itself (picklable for worker processes)."""
+    return convert_png_to_bin(png_path, compress=compress, palette=palette)
+
+
+def convert_glob(pattern: str, compress: bool = False,
+                 palette: bool = False) -> List[Tuple[bool, str]]:
+    """
+    Convert every PNG matching a glob pattern, in parallel across CPU cores.
+    
+    Args:
+        pattern (str): Glob pattern, e.g. 'images/*.png'
+        compress (bool): Whether to zlib-compress the pixel data
+        palette (bool): Whether to store low-color images as palette indices
+        
+    Returns:
+        list: (success: bool, message: str) for each matched file, in sorted order
+    """
+    png_paths = sorted(glob.glob(pattern))
+    if not png_paths:
+        return [(False, f"No files match: {pattern}")]
+    
+    with ProcessPoolExecutor() as executor:
+        n = len(png_paths)
+        return list(executor.map(_convert_one, png_paths, [compress] * n, [palette] * n))
+
+
+def main() -> None:
     """Command-line interface for the converter."""
-    if len(sys.argv) < 2:
+    options = {'--compress', '--palette'}
+    compress = '--compress' in sys.argv
+    palette = '--palette' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in options]
+    
+    if len(args) < 1:
         print("PNG to BIN Converter")
         print("\nUsage:")
         print("  python png_to_bin.py <input.png> [output.bin]")
         print("  python png_to_bin.py --to-png <input.bin> [output.png]")
+        print("  python png_to_bin.py '<pattern>'  (batch, e.g. 'images/*.png')")
+        print("\nOptions:")
+        print("  --compress    zlib-compress the pixel data in the BIN file")
+        print("  --palette     store images with <= 256 colors as 1-byte palette indices")
         print("\nExamples:")
         print("  python png_to_bin.py image.png")
         print("  python png_to_bin.py image.png image.bin")
+        print("  python png_to_bin.py --compress image.png")
         print("  python png_to_bin.py --to-png image.bin")
         sys.exit(1)
     
-    if sys.argv[1] == '--to-png':
-        # Convert BIN to PNG
-        if len(sys.argv) < 3:
+    png_file: Optional[str]
+    bin_file: Optional[str]
+    
+    if args[0] == '--to-png':
+        # Convert BIN to PNG (compression and palette mode are detected from the header)
+        if len(args) < 2:
             print("Error: Input BIN file required")
             sys.exit(1)
         
-        bin_file = sys.argv[2]
-        png_file = sys.argv[3] if len(sys.argv) > 3 else None
+        bin_file = args[1]
+        png_file = args[2] if len(args) > 2 else None
         success, message = read_bin_to_png(bin_file, png_file)
+    elif glob.has_magic(args[0]):
+        # Batch convert every PNG matching the pattern
+        results = convert_glob(args[0], compress, palette)
+        message = '\n'.join(msg for _, msg in results)
+        success = all(ok for ok, _ in results)
     else:
         # Convert PNG to BIN
-        png_file = sys.argv[1]
-        bin_file = sys.argv[2] if len(sys.argv) > 2 else None
-        success, message = convert_png_to_bin(png_file, bin_file)
+        png_file = args[0]
+        bin_file = args[1] if len(args) > 1 else None
+        success, message = convert_png_to_bin(png_file, bin_file, compress=compress, palette=palette)
     
     print(message)
     sys.exit(0 if success else 1)